@@ -0,0 +1,112 @@
+import numbers
+
+import numpy as np
+
+import physics
+
+# every dial on the instrument panel: name -> (values, continuous, initial)
+# continuous dials take any value in [values[0], values[1]], discrete dials
+# take one of values and start in the middle of the list unless told otherwise
+DIALS = {
+    'qwp_angle': ([0, 90], True, 0.0),
+    'amplitude': ([0, 20], True, None),
+    'frequency': ([0.01, 50], True, None),
+    'offset': ([-200, 200], True, None),
+    'ch1_division': ([10, 20, 50, 100, 200, 500, 1000, 2000, 5000], False, None),
+    'ch1_center': ([-25e3, 25e3], True, None),
+    'ch2_division': ([10, 20, 50, 100, 200, 500, 1000, 2000, 5000], False, None),
+    'ch2_center': ([-25e3, 25e3], True, None),
+    'time': ([10, 20, 50, 100, 200], False, None),
+}
+
+# every toggle on the instrument panel, all of which start off; xy only
+# changes how the oscilloscope draws the traces
+TOGGLES = ['laser', 'qwp', 'ch1', 'ch2', 'xy']
+
+
+def initial_value(name):
+    values, continuous, initial = DIALS[name]
+    if continuous:
+        return 0.5 * (values[0] + values[1]) if initial is None else initial
+    return values[len(values)//2] if initial is None or initial not in values else initial
+
+def default_state():
+    state = {name: initial_value(name) for name in DIALS}
+    state.update({name: False for name in TOGGLES})
+    return state
+
+def check(name, value):
+    """Return value converted for control name, raising ValueError if it cannot be set."""
+    if name in TOGGLES:
+        if not isinstance(value, (bool, np.bool_)):
+            raise ValueError(f'{name} must be True or False, got {value!r}')
+        return bool(value)
+    if name not in DIALS:
+        raise KeyError(f'unknown control {name!r}')
+    if not isinstance(value, numbers.Real) or isinstance(value, (bool, np.bool_)):
+        raise ValueError(f'{name} must be a number, got {value!r}')
+    values, continuous, _ = DIALS[name]
+    if continuous:
+        if not values[0] <= value <= values[1]:
+            raise ValueError(f'{name} must be between {values[0]} and {values[1]}, got {value}')
+        return float(value)
+    if value not in values:
+        raise ValueError(f'{name} must be one of {values}, got {value}')
+    return value
+
+
+class Lab:
+    """
+    Programmatic access to the instrument panel.
+
+    Every dial and toggle is addressed by its name in DIALS or TOGGLES. The
+    oscilloscope is read directly from the physics, so a script runs as fast
+    as numpy allows whether or not the window is open:
+
+        lab = Lab(seed=0)
+        lab.toggle('ch2', True)
+        for v in range(-200, 201, 10):
+            lab.set('offset', v)
+            t, ch1, ch2 = lab.read()
+            print(v, np.ptp(ch2))
+    """
+    def __init__(self, seed=None):
+        self.state = default_state()
+        self.rng = np.random.RandomState(seed)
+
+    def get(self, name):
+        return self.state[name]
+
+    def set(self, name, value):
+        self.store(name, check(name, value))
+
+    def toggle(self, name, on=None):
+        if name not in TOGGLES:
+            raise KeyError(f'unknown toggle {name!r}')
+        self.set(name, not self.state[name] if on is None else on)
+
+    def store(self, name, value):
+        self.state[name] = value
+
+    def reset(self):
+        for name, value in default_state().items():
+            self.store(name, value)
+
+    def read(self, n=1001):
+        """Return the time axis in seconds and the CH1 and CH2 traces in volts (None when off)."""
+        return physics.simulate(self.state, n, self.rng)
+
+    def read_screen(self, n=1001):
+        """Return the CH1 and CH2 traces as drawn on the screen, in -1 to 1 screen units."""
+        _, ch1, ch2 = self.read(n)
+        if ch1 is not None:
+            ch1 = physics.screen(ch1, self.state['ch1_center'], self.state['ch1_division'])
+        if ch2 is not None:
+            ch2 = physics.screen(ch2, self.state['ch2_center'], self.state['ch2_division'])
+        return ch1, ch2
+
+    def sweep(self, name, values, n=1001):
+        """Step control name through values, yielding each value with the traces read there."""
+        for value in values:
+            self.set(name, value)
+            yield (value,) + tuple(self.read(n))
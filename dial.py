@@ -188,6 +188,9 @@ class Dial:
             while a <= -180.0:
                 a += 360.0
                 self.rotations -= 1
+            # grab and drag from where the pointer is now drawn
+            self.current_angle = a
+            self.last_angle = a
 
         #
         # Call callback
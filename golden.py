@@ -0,0 +1,211 @@
+# -----------------------------------------------------------------------------
+# Golden-trace regression check for the physics in physics.py.
+#
+#   python golden.py --update    store reference traces and kernel costs
+#   python golden.py             compare against them
+#
+# The detector noise is seeded per state, so the traces are reproducible and
+# any change to the numbers students are graded against shows up here. The
+# reference is computed the way the original oscilloscope did, with jones_qwp
+# and jones_crystal, and every path the simulator uses today is compared with
+# it: simulate as the panel and replays call it, and the closed form
+# simulate_batch behind the server and the Monte Carlo runs. The traces are
+# also stored as drawn on the screen, mapped with the slope and intercept the
+# original oscilloscope used, and compared with physics.screen for every path.
+#
+# Kernel speed is measured relative to a plain numpy reference timed in the
+# same run, so the gate tracks the code and not how busy the machine is. The
+# check fails when a kernel costs more than the stored baseline allows.
+#
+import argparse
+import itertools
+import statistics
+import sys
+import timeit
+
+import numpy as np
+
+import controls
+import physics
+
+GRID = {
+    'laser': [False, True],
+    'qwp': [False, True],
+    'qwp_angle': [0.0, 22.5, 45.0, 67.5],
+    'amplitude': [0.0, 5.0, 20.0],
+    'frequency': [1.0, 10.0, 50.0],
+    'offset': [-200.0, -50.0, 0.0, 137.0, 200.0],
+    'time': [10, 200],
+}
+
+# the screen settings don't change the physics, so rather than multiplying the
+# grid by them, state i takes entry i of each list, wrapping around; the list
+# lengths are coprime so the combinations keep changing
+SCREEN = {
+    'ch1_division': [10, 200, 5000],
+    'ch1_center': [0.0, -25e3, 1234.5, 25e3],
+    'ch2_division': [20, 50, 100, 500, 2000],
+    'ch2_center': [0.0, 800.0, -350.0, 25e3, -25e3, -7.5, 12e3],
+}
+
+N = 101
+
+KERNELS = {
+    'jones_crystal': lambda: physics.jones_crystal(np.linspace(0, 2 * np.pi, 1001)),
+    'jones_qwp_exact': lambda: physics.jones_qwp_exact(30.0),
+    'jones_arbitrary': lambda: physics.jones_arbitrary(30.0, 0.5 * np.pi * 650.0 / 632.8),
+    'jones_waveplates': lambda: physics.jones_waveplates(np.linspace(0, 90, 1001), 0.5 * np.pi * 650.0 / 632.8),
+    'simulate': lambda: physics.simulate(dict(controls.default_state(), ch1=True, ch2=True, qwp=True)),
+    'simulate_batch': lambda: physics.simulate_batch([dict(controls.default_state(), ch1=True, ch2=True, qwp=True)] * 10),
+}
+
+
+def states():
+    names = list(GRID)
+    i = 0
+    for values in itertools.product(*GRID.values()):
+        state = controls.default_state()
+        state.update(zip(names, values))
+        state['ch1'] = state['ch2'] = True
+        # the angle does nothing without the plate, so don't store it four times
+        if not state['qwp'] and state['qwp_angle'] != GRID['qwp_angle'][0]:
+            continue
+        state.update({name: values[i % len(values)] for name, values in SCREEN.items()})
+        i += 1
+        yield state
+
+def columns(all_states, name):
+    return np.array([state[name] for state in all_states], dtype=float).reshape(-1, 1)
+
+def reference_screen(all_states, ch1, ch2):
+    # the mapping as the original animate wrote it out
+    m1 = 250. / columns(all_states, 'ch1_division')
+    b1 = -columns(all_states, 'ch1_center') / (4 * columns(all_states, 'ch1_division'))
+    m2 = 250.0 / columns(all_states, 'ch2_division')
+    b2 = -columns(all_states, 'ch2_center') / (4 * columns(all_states, 'ch2_division'))
+    return ch1 * m1 + b1, ch2 * m2 + b2
+
+def screen_traces(all_states, ch1, ch2):
+    screen1 = [physics.screen(v, state['ch1_center'], state['ch1_division']) for v, state in zip(ch1, all_states)]
+    screen2 = [physics.screen(v, state['ch2_center'], state['ch2_division']) for v, state in zip(ch2, all_states)]
+    return np.array(screen1), np.array(screen2)
+
+def reference_traces(all_states):
+    ch1s, ch2s = [], []
+    for i, state in enumerate(all_states):
+        j_qwp = physics.jones_qwp(state['qwp_angle'], physics.wavelength(state))
+        _, ch1, ch2 = physics.simulate(state, N, np.random.RandomState(i), j_qwp=j_qwp)
+        ch1s.append(ch1)
+        ch2s.append(ch2)
+    return np.array(ch1s), np.array(ch2s)
+
+def simulate_traces(all_states):
+    ch1s, ch2s = [], []
+    for i, state in enumerate(all_states):
+        _, ch1, ch2 = physics.simulate(state, N, np.random.RandomState(i))
+        ch1s.append(ch1)
+        ch2s.append(ch2)
+    return np.array(ch1s), np.array(ch2s)
+
+def batch_traces(all_states):
+    rngs = [np.random.RandomState(i) for i in range(len(all_states))]
+    _, ch1, ch2 = physics.simulate_batch(all_states, N, rngs)
+    return ch1, ch2
+
+PATHS = {
+    'reference': reference_traces,
+    'simulate': simulate_traces,
+    'simulate_batch': batch_traces,
+}
+
+
+def reference_kernel(x=np.linspace(0, 2 * np.pi, 1001)):
+    # plain numpy work of the same size and kind as the kernels
+    M = np.zeros((len(x), 2, 2), dtype=complex)
+    M[:, 0, 0] = np.cos(x)
+    M[:, 0, 1] = np.exp(1j * x)
+    return M
+
+def timer(kernel, duration=0.02):
+    """Return a function timing one call of kernel, averaged over about duration seconds."""
+    t = timeit.Timer(kernel)
+    number, elapsed = t.autorange()
+    number = max(1, int(number * duration / elapsed))
+    return lambda: t.timeit(number) / number
+
+def costs(repeat=15):
+    """Return the median cost of every kernel relative to reference_kernel, timed alternately."""
+    reference = timer(reference_kernel)
+    result = {}
+    for name, kernel in KERNELS.items():
+        time_kernel = timer(kernel)
+        result[name] = statistics.median(time_kernel() / reference() for _ in range(repeat))
+    return result
+
+
+def update(path):
+    all_states = list(states())
+    ch1, ch2 = reference_traces(all_states)
+    screen1, screen2 = reference_screen(all_states, ch1, ch2)
+    cost = costs()
+    np.savez_compressed(path, ch1=ch1, ch2=ch2, screen1=screen1, screen2=screen2,
+                        kernels=np.array(list(cost)), cost=np.array(list(cost.values())))
+    for name, c in cost.items():
+        print(f'{name}: {c:.3g} x reference')
+    print(f'stored {len(ch1)} states in {path}')
+
+def check(path, rtol, atol, slack, speed=True):
+    failures = []
+    with np.load(path) as f:
+        ch1_ref, ch2_ref = f['ch1'], f['ch2']
+        screen1_ref, screen2_ref = f['screen1'], f['screen2']
+        baseline = dict(zip(f['kernels'], f['cost']))
+
+    all_states = list(states())
+    for path_name, traces in PATHS.items():
+        ch1, ch2 = traces(all_states)
+        screen1, screen2 = screen_traces(all_states, ch1, ch2)
+        compared = [
+            ('CH1', ch1, ch1_ref, 'V'),
+            ('CH2', ch2, ch2_ref, 'V'),
+            ('CH1 screen', screen1, screen1_ref, 'screen units'),
+            ('CH2 screen', screen2, screen2_ref, 'screen units'),
+        ]
+        for label, new, ref, unit in compared:
+            if new.shape != ref.shape:
+                failures.append(f'{path_name} {label}: shape {new.shape} does not match reference {ref.shape}')
+                continue
+            bad = ~np.all(np.isclose(new, ref, rtol=rtol, atol=atol), axis=1)
+            for i in np.flatnonzero(bad):
+                error = np.max(np.abs(new[i] - ref[i]))
+                failures.append(f'{path_name} {label}: max error {error:.3g} {unit} at {all_states[i]}')
+        print(f'{path_name}: compared {len(all_states)} states')
+
+    if speed:
+        for name, c in costs().items():
+            if name not in baseline:
+                continue
+            if c > (1 + slack) * baseline[name]:
+                failures.append(f'{name}: {c:.3g} x reference is above the baseline of {baseline[name]:.3g} x')
+            else:
+                print(f'{name}: {c:.3g} x reference (baseline {baseline[name]:.3g} x)')
+
+    for failure in failures:
+        print('FAIL', failure)
+    return not failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the physics against stored golden traces')
+    parser.add_argument('--update', action='store_true', help='store new reference traces and kernel costs')
+    parser.add_argument('--path', default='golden.npz')
+    parser.add_argument('--rtol', type=float, default=1e-9)
+    parser.add_argument('--atol', type=float, default=1e-12)
+    parser.add_argument('--slack', type=float, default=0.5, help='fraction by which a kernel may cost more than its baseline')
+    parser.add_argument('--no-speed', action='store_true', help='only compare the traces')
+    args = parser.parse_args()
+
+    if args.update:
+        update(args.path)
+    elif not check(args.path, args.rtol, args.atol, args.slack, not args.no_speed):
+        sys.exit(1)
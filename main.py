@@ -1,4 +1,5 @@
 import argparse
+import inspect
 import numpy as np
 import matplotlib
 matplotlib.use("TkAgg")
@@ -9,12 +10,29 @@ import matplotlib.animation as mani
 from PIL import ImageTk, Image
 
 from dial import Dial, DiscreteDial
+import physics
+import controls
+import session
 
 import tkinter as tk
 
 parser = argparse.ArgumentParser(description='Run EP421 electro-optic experiment')
 parser.add_argument('--offline', action='store_true')
-offline = parser.parse_args().offline
+parser.add_argument('--script', help='python script to run against the panel, with the controls available as `lab`')
+parser.add_argument('--seed', type=int, help='seed for the detector noise')
+parser.add_argument('--record', help='file to record the session to (.npz)')
+parser.add_argument('--replay', help='recorded session to play back in real time')
+args = parser.parse_args()
+offline = args.offline
+
+if args.replay is not None:
+    replayed = session.load(args.replay)
+    seed = replayed.seed
+elif args.seed is not None:
+    seed = args.seed
+else:
+    seed = np.random.randint(2**31 - 1)
+rng = np.random.RandomState(seed)
 
 style.use("ggplot")
 
@@ -37,54 +55,6 @@ else:
     light_params = [7, 7, 31, 31]
 
 
-def jones_polaroid(angle):
-    rad = np.deg2rad(angle)
-    cos = np.cos(rad)
-    sin = np.sin(rad)
-    M = np.zeros((2, 2), dtype=np.complex)
-    M[0, 0] = cos * cos
-    M[0, 1] = M[1, 0] = sin * cos
-    M[1, 1] = sin * sin
-    return M
-
-def jones_qwp_exact(angle):
-    rad = np.deg2rad(angle)
-    cos = np.cos(rad)
-    sin = np.sin(rad)
-    M = np.zeros((2, 2), dtype=np.complex)
-    M[0, 0] = cos * cos + 1j * sin * sin
-    M[0, 1] = M[1, 0] = (1 - 1j) * sin * cos
-    M[1, 1] = sin * sin + 1j * cos * cos
-    M *= np.exp(-0.25j * np.pi)
-    return M
-
-def jones_arbitrary(angle, phase):
-    rad = np.deg2rad(angle)
-    cos = np.cos(rad)
-    sin = np.sin(rad)
-    plus = np.exp(0.5j * phase)
-    minus = np.exp(-0.5j * phase)
-    M = np.zeros((2, 2), dtype=np.complex)
-    M[0, 0] = cos * cos * minus + sin * sin * plus
-    M[0, 1] = M[1, 0] = (minus - plus) * cos * sin
-    M[1, 1] = sin * sin * minus + cos * cos * plus
-    return M
-
-def jones_crystal(phase):
-    # angle locked at 45 for now
-    phase = phase.reshape(1, 1, -1)
-    M = np.zeros((phase.shape[2], 2, 2), dtype=np.complex)
-    M[:, 0, 0] = M[:, 1, 1] = np.cos(0.5 * phase)
-    M[:, 0, 1] = M[:, 1, 0] = -1j * np.sin(0.5 * phase)
-    return M
-
-def jones_qwp(angle, wavelength):
-    if wavelength == 650.0:
-        return jones_qwp_exact(angle)
-    else:
-        phase = 0.5 * np.pi * 650.0 / wavelength
-        return jones_arbitrary(angle, phase)
-
 class ImageCanvas:
     def __init__(self, master, image_path, column, row, columnspan=1, rowspan=1, width=distance_1, height=distance_1, bg='black', **kwargs):
         img = Image.open(image_path)
@@ -152,6 +122,7 @@ class ToggleButton:
         self.frame = tk.Frame(master)
 
         self.command = command
+        self.listener = None # called with the new state whenever the button changes, used to record sessions
 
         self.center_frame = tk.Frame(self.frame, height=height, width=width)
 
@@ -212,10 +183,18 @@ class ToggleButton:
             if self.text_canvas is not None: self.text_canvas.itemconfig(self.canvas_text, text=self.text_on)
         if self.command is not None:
             self.command(self.on)
+        if self.listener is not None:
+            self.listener(self.on)
+
+    def set(self, on):
+        if on != self.on:
+            self.toggle()
 
     def reset(self):
         self.on = False
         self.light_canvas.itemconfig(self.light, fill='grey')
+        if self.listener is not None:
+            self.listener(self.on)
 
 
 class StateButton:
@@ -278,6 +257,7 @@ class LabelledDial:
         self.values = values
         self.continuous = continuous
         self.interval = interval
+        self.listener = None # called with the new state whenever the dial moves, used to record sessions
 
         self.precision = precision
         self.label = tk.Label(self.center_frame, text=label, font=FONT)
@@ -333,6 +313,11 @@ class LabelledDial:
     def command_continuous(self, deg):
         self.state = self.m * deg + self.b
         self.insert_entry()
+        self.update_secondary()
+        if self.listener is not None:
+            self.listener(self.state)
+
+    def update_secondary(self):
         if self.secondary_function is not None:
             self.secondary_value = self.secondary_function(self.state)
 
@@ -340,13 +325,17 @@ class LabelledDial:
         assert(index < len(self.values))
         self.state = self.values[index]
         self.insert_entry()
+        if self.listener is not None:
+            self.listener(self.state)
 
     def set(self, init):
         if self.continuous:
             deg = (init - self.b) / self.m
             self.dial.set_angle(deg, absolute=True)
         else:
-            raise NotImplementedError
+            index = self.values.index(init)
+            self.dial.current_index = index
+            self.dial.set_angle(self.dial.discrete_angles[index])
 
 
     def insert_entry(self):
@@ -360,7 +349,7 @@ class LabelledDial:
 
 
 class Oscilloscope:
-    def __init__(self, master, column, row, columnspan=1, rowspan=1):
+    def __init__(self, master, column, row, columnspan=1, rowspan=1, resolution=(300, 140), persistence=0.7):
         dpi = 100
         width = 600 / dpi
         height = 280 / dpi
@@ -371,6 +360,33 @@ class Oscilloscope:
         self.tkfig = FigureCanvasTkAgg(self.f, master)
         self.tkfig.get_tk_widget().grid(column=column, row=row, columnspan=columnspan, rowspan=rowspan)
 
+        # XY mode draws a fading density image of the (CH1, CH2) points instead
+        # of lines, so a frame costs the same however many points have landed
+        self.persistence = persistence # fraction of the image kept from one frame to the next
+        self.density = np.zeros(resolution[::-1])
+        self.image = None
+
+    def clear_xy(self):
+        self.density[:] = 0
+
+    def accumulate(self, x, y):
+        ny, nx = self.density.shape
+        self.density *= self.persistence
+        inside = (np.abs(x) < 1) & (np.abs(y) < 1)
+        ix = ((x[inside] + 1) * 0.5 * nx).astype(int)
+        iy = ((y[inside] + 1) * 0.5 * ny).astype(int)
+        self.density += np.bincount(iy * nx + ix, minlength=nx * ny).reshape(ny, nx)
+
+    def show_xy(self, x, y):
+        self.accumulate(x, y)
+        if self.image is None:
+            self.ax.clear()
+            self.image = self.ax.imshow(self.density, origin='lower', extent=(-1, 1, -1, 1), aspect='auto', interpolation='nearest', cmap='Blues')
+            self.ax.set_xlim(-1, 1)
+            self.ax.set_ylim(-1, 1)
+        self.image.set_data(self.density)
+        self.image.set_clim(0, max(self.density.max(), 1))
+
 window = tk.Tk()
 
 # set title
@@ -422,14 +438,15 @@ osc = Oscilloscope(window, column=2, row=9, columnspan=6)
 dial_frame = tk.Frame(window)
 dial_frame.grid(column=8, row=1, rowspan=9)
 
-laser_button = ToggleButton(dial_frame, image_path='imgs/laser.jpg', text='Laser', light=False, text_off='650.0\nnm', text_on='632.8\nnm')
+laser_button = ToggleButton(dial_frame, image_path='imgs/laser.jpg', text='Laser', light=False, text_off='650.0\nnm', text_on='632.8\nnm', command=lambda state: qwp_angle.update_secondary())
 qwp_button = ToggleButton(dial_frame, image_path='imgs/qwp.jpg', text='QWP', command=lambda state: qwp.swap())
 
 def qwp_secondary(angle):
+    # must match the matrix physics.simulate uses, or replayed traces drift
     if laser_button.on:
-        return jones_qwp(angle, 632.8)
+        return physics.qwp_matrix(angle, physics.WAVELENGTH_ON)
     else:
-        return jones_qwp(angle, 650.0)
+        return physics.qwp_matrix(angle, physics.WAVELENGTH_OFF)
 
 qwp_angle = LabelledDial(dial_frame, image_path='imgs/qwp.jpg', label='Angle', width=5, column=0, row=0, values=[0, 90], continuous=True, unit=u'\u00b0', maxRot=1, precision=1, secondary=qwp_secondary, initial=0.0)
 signal_amplitude = LabelledDial(dial_frame, image_path='imgs/signal-generator.jpg', label='Amplitude', width=5, column=0, row=0, values=[0, 20], continuous=True, unit='V', maxRot=1, precision=1)
@@ -442,62 +459,84 @@ ch2_toggle = ToggleButton(dial_frame, image_path='imgs/osc.jpg', text='CH2')
 ch2_interval_dial = LabelledDial(dial_frame, image_path='imgs/osc.jpg', label='Division', width=5, column=0, row=7, values=[10, 20, 50, 100, 200, 500, 1000, 2000, 5000], continuous=False, unit='mV')
 ch2_center_dial = LabelledDial(dial_frame, image_path='imgs/osc.jpg', label='Center', width=5, column=0, row=8, values=[-25e3, 25e3], continuous=True, interval=ch2_interval_dial, unit='mV')
 t_interval_dial = LabelledDial(dial_frame, image_path='imgs/osc.jpg', label='Time', width=5, column=0, row=9, values=[10, 20, 50, 100, 200], continuous=False, unit=u'\u03BCs')
+xy_toggle = ToggleButton(dial_frame, image_path='imgs/osc.jpg', text='XY', command=lambda state: osc.clear_xy())
 
 window.grid_rowconfigure(0, weight=1)
 window.grid_rowconfigure(10, weight=1)
 window.grid_columnconfigure(0, weight=1)
 window.grid_columnconfigure(8, weight=1)
 
+panel = {
+    'laser': laser_button,
+    'qwp': qwp_button,
+    'qwp_angle': qwp_angle,
+    'amplitude': signal_amplitude,
+    'frequency': signal_frequency,
+    'offset': amplifier_offset,
+    'ch1': ch1_toggle,
+    'ch1_division': ch1_interval_dial,
+    'ch1_center': ch1_center_dial,
+    'ch2': ch2_toggle,
+    'ch2_division': ch2_interval_dial,
+    'ch2_center': ch2_center_dial,
+    'time': t_interval_dial,
+    'xy': xy_toggle,
+}
+
+def panel_state():
+    return {name: widget.on if isinstance(widget, ToggleButton) else widget.state for name, widget in panel.items()}
+
+class PanelLab(controls.Lab):
+    """controls.Lab driving the widgets on the panel, so the window follows the script."""
+    def __init__(self):
+        self.state = panel_state()
+        # separate from the display's noise, so scripts don't disturb a recording
+        self.rng = np.random.RandomState(seed + 1)
+
+    def store(self, name, value):
+        panel[name].set(value)
+        self.state = panel_state()
+
+    def read(self, n=1001):
+        self.state = panel_state()
+        return physics.simulate(self.state, n, self.rng, j_qwp=qwp_angle.secondary_value)
+
+recorder = None
+if args.record is not None:
+    recorder = session.Recorder(seed)
+    recorder.snapshot(panel_state())
+    for name, widget in panel.items():
+        widget.listener = lambda value, name=name: recorder.log(name, value)
+
 def animate(i):
     n = 1001
-    omega = 2e3 * np.pi * signal_frequency.state
-    vmod = signal_amplitude.state
-    dcbias = amplifier_offset.state
-    tint = t_interval_dial.state
+    state = panel_state()
 
     t_display = np.linspace(-1, 1, n)
-    t_true = np.linspace(-1, 1, n) * 5e-6 * tint
+    _, vin_monitor, vout_true = physics.simulate(state, n, rng, j_qwp=qwp_angle.secondary_value)
+    if recorder is not None:
+        recorder.frame()
+
+    if vin_monitor is not None:
+        vin_display = physics.screen(vin_monitor, state['ch1_center'], state['ch1_division'])
+    if vout_true is not None:
+        vout_display = physics.screen(vout_true, state['ch2_center'], state['ch2_division'])
+
+    if state['xy']:
+        # CH1 drives the horizontal, CH2 the vertical; nothing lands without both
+        if vin_monitor is not None and vout_true is not None:
+            osc.show_xy(vin_display, vout_display)
+        else:
+            osc.show_xy(np.empty(0), np.empty(0))
+        return
 
+    osc.image = None
     osc.ax.clear()
 
-    ch1_ctr = ch1_center_dial.state
-    ch1_int = ch1_interval_dial.state
-
-    m1 = 250. / ch1_int
-    b1 = -ch1_ctr / (4 * ch1_int)
-
-    vin_true = dcbias + vmod * np.sin(omega * t_true)
-    # vin_true += np.random.normal(0.0, 0.500, n)
-
-    if ch1_toggle.on:
-        vin_monitor = vin_true * 0.05
-        vin_display = vin_monitor * m1 + b1
+    if vin_monitor is not None:
         osc.ax.plot(t_display, vin_display, 'y')
 
-    if ch2_toggle.on:
-        ch2_ctr = ch2_center_dial.state
-        ch2_int = ch2_interval_dial.state
-
-        m2 = 250.0 / ch2_int
-        b2 = -ch2_ctr / (4 * ch2_int)
-
-        vout_min = -910 / 1000 # voltage corresponding to 0 transmittance in volts
-        vout_max = 1460 / 1000 # voltage corresponding to 1 transmittance in volts
-        vout_center = 0.5 * (vout_min + vout_max)
-        vout_amplitude = (vout_max - vout_min) / 2
-        halfwave = 206.2 if laser_button.on else 223.6 # half wave voltage in volts
-        offset = 2.4
-
-        phase = np.pi * (vin_true) / halfwave + offset
-        j_crystal = jones_crystal(phase)
-        j_qwp = qwp_angle.secondary_value if qwp_button.on else np.eye(2, dtype=np.complex)
-        j_total = j_qwp @ j_crystal
-        transmittance = np.abs(j_total[:, 1, 0])**2
-        vout_true = transmittance * vout_amplitude + vout_center
-        vout_true += np.random.normal(0, 0.001, n)
-
-        vout_display = vout_true * m2 + b2
-
+    if vout_true is not None:
         osc.ax.plot(t_display, vout_display, 'b')
 
     osc.ax.set_xlim(-1, 1)
@@ -516,12 +555,43 @@ def reset_command():
     ch2_interval_dial.dial.reset()
     ch2_center_dial.dial.reset()
     t_interval_dial.dial.reset()
+    xy_toggle.reset()
 
 reset = tk.Button(dial_frame, text='RESET', width=5, height=1, command=reset_command)
 reset.pack()
 
 # start the main application loop
-window.geometry('800x600') # pixels
+window.geometry('800x640') # pixels
 window.resizable(0, 0)
 ani = mani.FuncAnimation(osc.f, animate, interval=200)
+
+def run_script():
+    lab = PanelLab()
+    namespace = {'lab': lab, 'np': np}
+    with open(args.script) as f:
+        code = compile(f.read(), args.script, 'exec')
+    exec(code, namespace)
+    if 'run' in namespace:
+        if not inspect.isgeneratorfunction(namespace['run']):
+            raise TypeError(f'{args.script}: run(lab) must be a generator, yield between steps to let the window redraw')
+        step_script(namespace['run'](lab))
+
+def step_script(steps):
+    # resume the script's run(lab) generator until its next yield, then let
+    # the window redraw and animate before resuming after the yielded delay
+    try:
+        delay = next(steps)
+    except StopIteration:
+        return
+    window.after(int(delay or 0), window.after_idle, step_script, steps)
+
+if args.script is not None:
+    window.after(0, run_script)
+if args.replay is not None:
+    for t, name, value in replayed.events():
+        if name is not None:
+            window.after(int(1000 * t), panel[name].set, value)
 window.mainloop()
+
+if recorder is not None:
+    recorder.save(args.record)
@@ -0,0 +1,148 @@
+# -----------------------------------------------------------------------------
+# Monte Carlo error bars for the quantities extracted in the lab report.
+#
+#   python montecarlo.py vpi_fit --realisations 1000
+#
+# A protocol repeats a measurement for many realisations of the detector
+# noise, and optionally of the static birefringence of the crystal, which
+# drifts between runs. The realisations of one chunk are computed together
+# along the first array axis, and chunks are spread over processes.
+#
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import controls
+import physics
+
+
+class Distribution:
+    """
+    Results of a protocol over all realisations.
+
+    A realisation where the protocol could not measure anything, such as an
+    extremum pushed outside the sweep, is NaN in samples and counted in
+    failed; the statistics only use the others.
+    """
+    def __init__(self, samples):
+        self.samples = samples
+        self.valid = samples[~np.isnan(samples)]
+        self.failed = len(samples) - len(self.valid)
+
+    def mean(self):
+        return np.mean(self.valid)
+
+    def std(self):
+        return np.std(self.valid, ddof=1)
+
+    def interval(self, level=0.95):
+        """Return the central confidence interval containing level of the valid samples."""
+        return tuple(np.percentile(self.valid, [50 * (1 - level), 50 * (1 + level)]))
+
+
+def sweep(rng, count, name, values, base=None, offset_jitter=0.0, n=101):
+    """
+    Return the CH2 traces of count realisations of stepping control name through values.
+
+    The result has shape (count, len(values), n). offset_jitter is the
+    standard deviation in radians of the crystal's static phase offset, drawn
+    once per realisation.
+    """
+    base = dict(controls.default_state(), ch2=True) if base is None else base
+    states = [dict(base, **{name: value}) for value in values] * count
+    phase_offset = physics.PHASE_OFFSET + offset_jitter * rng.standard_normal((count, 1))
+    phase_offset = np.repeat(phase_offset, len(values), axis=0)
+    _, _, ch2 = physics.simulate_batch(states, n, rng, phase_offset)
+    return ch2.reshape(count, len(values), n)
+
+def vertex(x, y, i):
+    """
+    Refine the extremum of each row of y at index i[row] with a parabola through its neighbours.
+
+    An extremum on the first or last point may lie beyond the sweep, so it
+    gives NaN rather than a position biased towards the inside.
+    """
+    edge = (i == 0) | (i == len(x) - 1)
+    i = np.clip(i, 1, len(x) - 2)
+    rows = np.arange(len(y))
+    y0, y1, y2 = y[rows, i - 1], y[rows, i], y[rows, i + 1]
+    curvature = y0 - 2 * y1 + y2
+    shift = np.divide(0.5 * (y0 - y2), curvature, out=np.zeros_like(y1), where=curvature != 0)
+    return np.where(edge, np.nan, x[i] + np.clip(shift, -1, 1) * (x[1] - x[0]))
+
+
+def vpi_minmax(rng, count, laser=False, offsets=np.linspace(-200, 200, 401), offset_jitter=0.0, n=101):
+    """Half wave voltage as the distance between the DC offsets of minimum and maximum transmission."""
+    base = dict(controls.default_state(), ch2=True, laser=laser, amplitude=0.0)
+    signal = sweep(rng, count, 'offset', offsets, base, offset_jitter, n).mean(axis=2)
+    low = vertex(offsets, signal, np.argmin(signal, axis=1))
+    high = vertex(offsets, signal, np.argmax(signal, axis=1))
+    return np.abs(high - low)
+
+def vpi_fit(rng, count, laser=False, offsets=np.linspace(-200, 200, 81), offset_jitter=0.0, n=101, candidates=np.linspace(150, 300, 301)):
+    """Half wave voltage from a least squares fit of a + b cos(pi V / V_pi) + c sin(pi V / V_pi) to the DC offset sweep."""
+    base = dict(controls.default_state(), ch2=True, laser=laser, amplitude=0.0)
+    signal = sweep(rng, count, 'offset', offsets, base, offset_jitter, n).mean(axis=2)
+
+    # the model is linear for a fixed V_pi, so scan V_pi and keep the best fit
+    residual = np.empty((count, len(candidates)))
+    total = np.sum(signal**2, axis=1)
+    for j, vpi in enumerate(candidates):
+        X = np.stack([np.ones_like(offsets), np.cos(np.pi * offsets / vpi), np.sin(np.pi * offsets / vpi)], axis=1)
+        Q, _ = np.linalg.qr(X)
+        residual[:, j] = total - np.sum((signal @ Q)**2, axis=1)
+    return vertex(candidates, residual, np.argmin(residual, axis=1))
+
+def modulation_depth(rng, count, laser=False, offset=0.0, amplitude=10.0, frequency=1.0, offset_jitter=0.0, n=1001):
+    """Peak to peak CH2 swing as a fraction of the full swing from zero to full transmission."""
+    base = dict(controls.default_state(), ch2=True, laser=laser, amplitude=amplitude, frequency=frequency)
+    trace = sweep(rng, count, 'offset', [offset], base, offset_jitter, n)[:, 0]
+    return np.ptp(trace, axis=1) / (physics.VOUT_MAX - physics.VOUT_MIN)
+
+PROTOCOLS = {
+    'vpi_minmax': vpi_minmax,
+    'vpi_fit': vpi_fit,
+    'modulation_depth': modulation_depth,
+}
+
+
+def run_chunk(protocol, seed, count, kwargs):
+    return PROTOCOLS[protocol](np.random.default_rng(seed), count, **kwargs)
+
+def run(protocol, realisations=1000, seed=None, workers=None, chunk=50, **kwargs):
+    """
+    Repeat protocol for realisations independent noise draws and return the Distribution of its result.
+
+    The realisations are split into chunks with independent random streams
+    spawned from seed, so the result does not depend on the number of workers.
+    workers=1 runs in this process.
+    """
+    counts = [min(chunk, realisations - start) for start in range(0, realisations, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(counts))
+    args = [(protocol, s, count, kwargs) for s, count in zip(seeds, counts)]
+    if workers == 1:
+        results = [run_chunk(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(run_chunk, *zip(*args)))
+    return Distribution(np.concatenate(results))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Monte Carlo uncertainty of EP421 measurements')
+    parser.add_argument('protocol', choices=list(PROTOCOLS))
+    parser.add_argument('--realisations', type=int, default=1000)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--laser', action='store_true', help='use the 632.8 nm laser')
+    parser.add_argument('--offset-jitter', type=float, default=0.0, help='standard deviation of the crystal phase offset in radians')
+    parser.add_argument('--level', type=float, default=0.95)
+    args = parser.parse_args()
+
+    result = run(args.protocol, args.realisations, args.seed, args.workers, laser=args.laser, offset_jitter=args.offset_jitter)
+    if result.failed:
+        print(f'{result.failed} of {len(result.samples)} realisations found an extremum at the edge of the sweep and were left out')
+    if len(result.valid) > 1:
+        low, high = result.interval(args.level)
+        print(f'{args.protocol}: {result.mean():.4g} +/- {result.std():.2g} ({100 * args.level:.0f}% interval {low:.4g} to {high:.4g})')
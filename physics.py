@@ -0,0 +1,186 @@
+import functools
+
+import numpy as np
+
+# laser wavelengths in nm, indexed by the state of the laser toggle
+WAVELENGTH_OFF = 650.0
+WAVELENGTH_ON = 632.8
+
+# half wave voltages in volts, indexed the same way
+HALFWAVE_OFF = 223.6
+HALFWAVE_ON = 206.2
+
+PHASE_OFFSET = 2.4 # static birefringence of the crystal in radians
+
+VOUT_MIN = -910 / 1000 # voltage corresponding to 0 transmittance in volts
+VOUT_MAX = 1460 / 1000 # voltage corresponding to 1 transmittance in volts
+
+MONITOR_GAIN = 0.05 # fraction of the amplifier output sent to CH1
+NOISE = 0.001 # standard deviation of the detector noise in volts
+
+
+def jones_polaroid(angle):
+    rad = np.deg2rad(angle)
+    cos = np.cos(rad)
+    sin = np.sin(rad)
+    M = np.zeros((2, 2), dtype=complex)
+    M[0, 0] = cos * cos
+    M[0, 1] = M[1, 0] = sin * cos
+    M[1, 1] = sin * sin
+    return M
+
+def jones_qwp_exact(angle):
+    rad = np.deg2rad(angle)
+    cos = np.cos(rad)
+    sin = np.sin(rad)
+    M = np.zeros((2, 2), dtype=complex)
+    M[0, 0] = cos * cos + 1j * sin * sin
+    M[0, 1] = M[1, 0] = (1 - 1j) * sin * cos
+    M[1, 1] = sin * sin + 1j * cos * cos
+    M *= np.exp(-0.25j * np.pi)
+    return M
+
+def jones_arbitrary(angle, phase):
+    rad = np.deg2rad(angle)
+    cos = np.cos(rad)
+    sin = np.sin(rad)
+    plus = np.exp(0.5j * phase)
+    minus = np.exp(-0.5j * phase)
+    M = np.zeros((2, 2), dtype=complex)
+    M[0, 0] = cos * cos * minus + sin * sin * plus
+    M[0, 1] = M[1, 0] = (minus - plus) * cos * sin
+    M[1, 1] = sin * sin * minus + cos * cos * plus
+    return M
+
+def jones_crystal(phase):
+    # angle locked at 45 for now
+    phase = phase.reshape(1, 1, -1)
+    M = np.zeros((phase.shape[2], 2, 2), dtype=complex)
+    M[:, 0, 0] = M[:, 1, 1] = np.cos(0.5 * phase)
+    M[:, 0, 1] = M[:, 1, 0] = -1j * np.sin(0.5 * phase)
+    return M
+
+def jones_qwp(angle, wavelength):
+    if wavelength == 650.0:
+        return jones_qwp_exact(angle)
+    else:
+        phase = 0.5 * np.pi * 650.0 / wavelength
+        return jones_arbitrary(angle, phase)
+
+@functools.lru_cache(maxsize=4096)
+def qwp_matrix(angle, wavelength):
+    # jones_qwp, cached because the panel asks for the same few angles over
+    # and over while a dial is dragged; the result is shared, so read only
+    M = jones_qwp(angle, wavelength)
+    M.setflags(write=False)
+    return M
+
+def jones_waveplates(angles, phase):
+    # jones_arbitrary for arrays of angles and phases, with shape
+    # broadcast(angles, phase).shape + (2, 2)
+    rad = np.deg2rad(angles)
+    cos = np.cos(rad)
+    sin = np.sin(rad)
+    plus = np.exp(0.5j * phase)
+    minus = np.exp(-0.5j * phase)
+    M = np.zeros(np.broadcast(angles, phase).shape + (2, 2), dtype=complex)
+    M[..., 0, 0] = cos * cos * minus + sin * sin * plus
+    M[..., 0, 1] = M[..., 1, 0] = (minus - plus) * cos * sin
+    M[..., 1, 1] = sin * sin * minus + cos * cos * plus
+    return M
+
+
+def wavelength(state):
+    return WAVELENGTH_ON if state['laser'] else WAVELENGTH_OFF
+
+def halfwave(state):
+    return HALFWAVE_ON if state['laser'] else HALFWAVE_OFF
+
+def time_axis(state, n=1001):
+    # the screen spans 10 divisions of t_interval microseconds
+    return np.linspace(-1, 1, n) * 5e-6 * state['time']
+
+def screen(volts, center, division):
+    # center and division are in mV, the screen spans -1 to 1 over 8 divisions
+    return volts * (250. / division) - center / (4 * division)
+
+
+def simulate(state, n=1001, rng=np.random, j_qwp=None):
+    """
+    Compute the oscilloscope signals for an instrument state.
+
+    state is a dict of control values as described in controls.py. Returns the
+    true time axis in seconds and the CH1 and CH2 voltages in volts; a channel
+    that is switched off is returned as None and draws no noise. j_qwp
+    overrides the quarter wave plate matrix computed from the state.
+    """
+    omega = 2e3 * np.pi * state['frequency']
+    t_true = time_axis(state, n)
+
+    vin_true = state['offset'] + state['amplitude'] * np.sin(omega * t_true)
+
+    ch1 = vin_true * MONITOR_GAIN if state['ch1'] else None
+
+    ch2 = None
+    if state['ch2']:
+        vout_center = 0.5 * (VOUT_MIN + VOUT_MAX)
+        vout_amplitude = (VOUT_MAX - VOUT_MIN) / 2
+
+        phase = np.pi * vin_true / halfwave(state) + PHASE_OFFSET
+        j_crystal = jones_crystal(phase)
+        if not state['qwp']:
+            j_qwp = np.eye(2, dtype=complex)
+        elif j_qwp is None:
+            j_qwp = qwp_matrix(state['qwp_angle'], wavelength(state))
+        j_total = j_qwp @ j_crystal
+        transmittance = np.abs(j_total[:, 1, 0])**2
+        ch2 = transmittance * vout_amplitude + vout_center
+        ch2 += rng.normal(0, NOISE, n)
+
+    return t_true, ch1, ch2
+
+
+def simulate_batch(states, n=1001, rngs=None, phase_offset=PHASE_OFFSET):
+    """
+    Compute simulate for many instrument states in one vectorized pass.
+
+    Returns the time axes, CH1 and CH2 voltages as arrays of shape
+    (len(states), n). Both channels are computed for every state, but the
+    noise for a state is only drawn when its CH2 is on. rngs is either one
+    generator for the whole batch or one per state; with one per state each
+    state sees the same noise as it would from simulate. phase_offset may be
+    an array of shape (len(states), 1) to vary the crystal per state.
+    """
+    def column(name):
+        return np.array([state[name] for state in states], dtype=float).reshape(-1, 1)
+
+    t_true = np.linspace(-1, 1, n) * 5e-6 * column('time')
+    omega = 2e3 * np.pi * column('frequency')
+    vin_true = column('offset') + column('amplitude') * np.sin(omega * t_true)
+
+    ch1 = vin_true * MONITOR_GAIN
+
+    laser = column('laser').astype(bool)
+    half_phase = 0.5 * (np.pi * vin_true / np.where(laser, HALFWAVE_ON, HALFWAVE_OFF) + phase_offset)
+
+    # with the crystal at 45 degrees, (j_qwp @ j_crystal)[1, 0] only needs the
+    # bottom row of the plate matrix, so skip building the crystal matrices
+    retardance = 0.5 * np.pi * 650.0 / np.where(laser, WAVELENGTH_ON, WAVELENGTH_OFF)
+    j_qwp = jones_waveplates(column('qwp_angle').ravel(), retardance.ravel())
+    j_qwp[~column('qwp').astype(bool).ravel()] = np.eye(2)
+    j_10 = j_qwp[:, 1, 0].reshape(-1, 1)
+    j_11 = j_qwp[:, 1, 1].reshape(-1, 1)
+    transmittance = np.abs(j_10 * np.cos(half_phase) - 1j * j_11 * np.sin(half_phase))**2
+
+    vout_center = 0.5 * (VOUT_MIN + VOUT_MAX)
+    vout_amplitude = (VOUT_MAX - VOUT_MIN) / 2
+    ch2 = transmittance * vout_amplitude + vout_center
+    if rngs is None or hasattr(rngs, 'normal'):
+        on = column('ch2').astype(bool).ravel()
+        ch2[on] += (np.random if rngs is None else rngs).normal(0, NOISE, (np.count_nonzero(on), n))
+    else:
+        for i, state in enumerate(states):
+            if state['ch2']:
+                ch2[i] += rngs[i].normal(0, NOISE, n)
+
+    return t_true, ch1, ch2
@@ -0,0 +1,191 @@
+# -----------------------------------------------------------------------------
+# Simulation server hosting one independent instrument panel per connection,
+# so a whole lab section can run the experiment from one machine.
+#
+#   python server.py --port 8421            serve the lab section
+#   python server.py --loadtest 128         time 128 loopback clients
+#
+# Clients send one JSON object per line, {"set": name, "value": value} or
+# {"toggle": name}, using the control names in controls.py. Every tick the
+# server advances all sessions in a single call to physics.simulate_batch and
+# sends each client a JSON header line, {"frame": k, "n": n, "ch1": bool,
+# "ch2": bool}, followed by the float32 screen trace of each channel that is
+# switched on. Errors come back as {"error": message}, unless the client has
+# fallen behind on reading; a line longer than the stream limit of 64 KiB
+# closes the connection.
+#
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+
+import controls
+import physics
+
+MAX_BUFFER = 1 << 20 # skip frames and errors for clients that fall this many bytes behind
+
+
+class Session:
+    def __init__(self, seed, writer):
+        self.lab = controls.Lab(seed=seed)
+        self.writer = writer
+
+    def command(self, line):
+        try:
+            message = json.loads(line)
+            if 'set' in message:
+                self.lab.set(message['set'], message['value'])
+            elif 'toggle' in message:
+                self.lab.toggle(message['toggle'], message.get('on'))
+            else:
+                raise ValueError(f'unknown command {line!r}')
+        except (ValueError, KeyError, TypeError) as e:
+            if not self.behind():
+                self.writer.write(json.dumps({'error': str(e)}).encode() + b'\n')
+
+    def behind(self):
+        return self.writer.transport.get_write_buffer_size() > MAX_BUFFER
+
+    def send(self, frame, n, ch1, ch2):
+        if self.behind():
+            return
+        state = self.lab.state
+        header = {'frame': frame, 'n': n, 'ch1': state['ch1'], 'ch2': state['ch2']}
+        self.writer.write(json.dumps(header).encode() + b'\n')
+        if state['ch1']:
+            self.writer.write(physics.screen(ch1, state['ch1_center'], state['ch1_division']).astype(np.float32).tobytes())
+        if state['ch2']:
+            self.writer.write(physics.screen(ch2, state['ch2_center'], state['ch2_division']).astype(np.float32).tobytes())
+
+
+class Server:
+    def __init__(self, rate=5.0, n=1001, seed=0):
+        self.rate = rate
+        self.n = n
+        self.seed = seed
+        self.sessions = []
+        self.connections = 0
+        self.frame = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        session = Session(self.seed + self.connections, writer)
+        self.sessions.append(session)
+        try:
+            async for line in reader:
+                session.command(line)
+        except (ConnectionError, ValueError):
+            # ValueError is a line over the stream limit, which no command needs
+            pass
+        finally:
+            self.sessions.remove(session)
+            writer.close()
+
+    def tick(self):
+        self.frame += 1
+        sessions = list(self.sessions)
+        if not sessions:
+            return
+        _, ch1, ch2 = physics.simulate_batch([s.lab.state for s in sessions], self.n, [s.lab.rng for s in sessions])
+        for i, session in enumerate(sessions):
+            session.send(self.frame, self.n, ch1[i], ch2[i])
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        period = 1 / self.rate
+        while True:
+            start = loop.time()
+            self.tick()
+            await asyncio.sleep(max(0.0, period - (loop.time() - start)))
+
+    async def serve(self, host='127.0.0.1', port=8421):
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await self.run()
+
+
+class Client:
+    """Thin client for one session on the server."""
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host='127.0.0.1', port=8421):
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def send(self, message):
+        self.writer.write(json.dumps(message).encode() + b'\n')
+        await self.writer.drain()
+
+    async def set(self, name, value):
+        await self.send({'set': name, 'value': value})
+
+    async def toggle(self, name, on=None):
+        await self.send({'toggle': name, 'on': on})
+
+    async def read(self):
+        """Return the next frame number and its CH1 and CH2 screen traces (None when off)."""
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError('server closed the session')
+        header = json.loads(line)
+        if 'error' in header:
+            raise ValueError(header['error'])
+        traces = []
+        for channel in ['ch1', 'ch2']:
+            if header[channel]:
+                data = await self.reader.readexactly(4 * header['n'])
+                traces.append(np.frombuffer(data, dtype=np.float32))
+            else:
+                traces.append(None)
+        return (header['frame'],) + tuple(traces)
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def loadtest(sessions=128, frames=25, rate=20.0, port=8421):
+    """Serve on the loopback interface and time sessions clients turning dials and reading frames."""
+    server = Server(rate=rate)
+    listener = await asyncio.start_server(server.handle, '127.0.0.1', port)
+    ticker = asyncio.ensure_future(server.run())
+
+    async def student(i):
+        rng = np.random.RandomState(i)
+        client = await Client.connect(port=port)
+        await client.toggle('ch1', True)
+        await client.toggle('ch2', True)
+        for _ in range(frames):
+            await client.set('offset', rng.uniform(-200, 200))
+            await client.read()
+        await client.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[student(i) for i in range(sessions)])
+    elapsed = time.perf_counter() - start
+
+    ticker.cancel()
+    listener.close()
+    await listener.wait_closed()
+
+    print(f'{sessions} sessions, {sessions * frames} frames in {elapsed:.2f} s '
+          f'({sessions * frames / elapsed:.0f} frames/s, {server.frame / elapsed:.1f} ticks/s at {rate:.0f} requested)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve EP421 electro-optic experiment sessions')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8421)
+    parser.add_argument('--rate', type=float, default=5.0, help='frames per second sent to each session')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--loadtest', type=int, metavar='SESSIONS', help='time this many loopback clients instead of serving')
+    args = parser.parse_args()
+
+    if args.loadtest is not None:
+        asyncio.run(loadtest(args.loadtest, port=args.port))
+    else:
+        asyncio.run(Server(args.rate, seed=args.seed).serve(args.host, args.port))
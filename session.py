@@ -0,0 +1,89 @@
+import time
+
+import numpy as np
+
+import controls
+
+# controls are stored by their index in NAMES, oscilloscope frames as FRAME
+NAMES = list(controls.DIALS) + controls.TOGGLES
+FRAME = -1
+
+
+class Recorder:
+    """
+    Log of the control changes and oscilloscope frames in a session.
+
+    Each event is a time in seconds since the recorder was created, a control
+    code and a value. Together with the seed of the random number generator
+    that drew the detector noise, this is enough to regenerate every frame.
+    """
+    def __init__(self, seed, clock=time.perf_counter):
+        self.seed = seed
+        self.clock = clock
+        self.start = clock()
+        self.times = []
+        self.codes = []
+        self.values = []
+
+    def log(self, name, value):
+        self.times.append(self.clock() - self.start)
+        self.codes.append(NAMES.index(name))
+        self.values.append(float(value))
+
+    def snapshot(self, state):
+        for name in NAMES:
+            self.log(name, state[name])
+
+    def frame(self):
+        self.times.append(self.clock() - self.start)
+        self.codes.append(FRAME)
+        self.values.append(0.0)
+
+    def save(self, path):
+        np.savez_compressed(path, seed=self.seed, times=np.array(self.times), codes=np.array(self.codes, dtype=np.int8), values=np.array(self.values))
+
+
+class Session:
+    def __init__(self, seed, times, codes, values):
+        self.seed = seed
+        self.times = times
+        self.codes = codes
+        self.values = values
+
+    def events(self):
+        """Yield (time, name, value) for every event, with name None for a frame."""
+        for t, code, value in zip(self.times, self.codes, self.values):
+            if code == FRAME:
+                yield t, None, None
+            else:
+                name = NAMES[code]
+                yield t, name, bool(value) if name in controls.TOGGLES else value.item()
+
+
+def load(path):
+    with np.load(path) as f:
+        return Session(f['seed'].item(), f['times'], f['codes'], f['values'])
+
+
+def replay(session, lab=None, realtime=False, n=1001):
+    """
+    Feed a recorded session to lab, yielding the traces read at every frame.
+
+    By default a headless controls.Lab seeded like the recording is used, so
+    the traces match the ones drawn during the session. With realtime the
+    events are spaced out as they were recorded, otherwise they are applied
+    as fast as possible.
+    """
+    if lab is None:
+        lab = controls.Lab(seed=session.seed)
+    start = time.perf_counter()
+    for t, name, value in session.events():
+        if realtime:
+            delay = start + t - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        if name is None:
+            yield lab.read(n)
+        else:
+            # recorded values came from the panel, so skip the range checks
+            lab.store(name, value)